@@ -0,0 +1,218 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from threading import Lock
+from typing import Optional
+
+from embeddings import embed_query
+
+# Cache settings
+MAX_ENTRIES = 10_000
+TTL_SECONDS = 3600
+SIMILARITY_THRESHOLD = 0.95
+SEMANTIC_CANDIDATES = 5
+DISK_CACHE_DIR = os.getenv("LLM_CACHE_DIR", "./.llm_cache")
+
+logger = logging.getLogger(__name__)
+
+# Numbers and quoted strings; questions that differ only in these read alike
+# to the embedding model but need different SQL
+LITERAL_PATTERN = re.compile(r"\d+(?:\.\d+)?|'[^']*'|\"[^\"]*\"")
+
+# Exact tier: key -> (stored_at, schema_hash, literals, value), oldest first
+_entries: "OrderedDict[str, tuple[float, str, tuple[str, ...], dict]]" = OrderedDict()
+
+# Semantic tier: faiss id <-> exact key
+_index = None
+_id_to_key: dict[int, str] = {}
+_key_to_id: dict[str, int] = {}
+_next_id = 0
+
+_lock = Lock()
+
+def normalize_query(query: str) -> str:
+    """Lowercase the query and collapse whitespace."""
+    return " ".join(query.lower().split())
+
+@lru_cache(maxsize=8)
+def schema_hash(schema: str) -> str:
+    """Hash a schema description so cached answers are tied to it."""
+    return hashlib.sha256(schema.encode()).hexdigest()
+
+def query_literals(query: str) -> tuple[str, ...]:
+    """Get the numbers and quoted strings of a query, in order."""
+    return tuple(LITERAL_PATTERN.findall(query))
+
+def make_key(query: str, schema_hash: str) -> str:
+    """Build the exact-match cache key for a query."""
+    return hashlib.sha256((schema_hash + normalize_query(query)).encode()).hexdigest()
+
+def _remove(key: str) -> None:
+    """Drop a key from both tiers. Caller must hold the lock."""
+    _entries.pop(key, None)
+    faiss_id = _key_to_id.pop(key, None)
+    if faiss_id is not None:
+        import numpy as np
+        _id_to_key.pop(faiss_id, None)
+        _index.remove_ids(np.array([faiss_id], dtype="int64"))
+
+def _lookup(key: str) -> Optional[dict]:
+    """Return a live exact-tier entry. Caller must hold the lock."""
+    entry = _entries.get(key)
+    if entry is None:
+        return None
+    stored_at, _, _, value = entry
+    if time.monotonic() - stored_at > TTL_SECONDS:
+        _remove(key)
+        return None
+    _entries.move_to_end(key)
+    return value
+
+def get(query: str, schema_hash: str) -> Optional[dict]:
+    """Return a cached answer for the query, or None on a miss.
+
+    The cache is best-effort: any failure, e.g. in the embeddings call,
+    is logged and treated as a miss.
+    """
+    try:
+        return _get(query, schema_hash)
+    except Exception as e:
+        logger.warning("Response cache lookup failed: %s", e)
+        return None
+
+def _get(query: str, schema_hash: str) -> Optional[dict]:
+    key = make_key(query, schema_hash)
+    with _lock:
+        value = _lookup(key)
+        if value is not None or _index is None or _index.ntotal == 0:
+            return value
+
+    # Fall back to the closest previously answered question with the same
+    # literals; "orders of customer 12" must not answer "customer 13"
+    literals = query_literals(query)
+    vector = embed_query(normalize_query(query))
+    with _lock:
+        scores, ids = _index.search(vector, SEMANTIC_CANDIDATES)
+        for score, faiss_id in zip(scores[0], ids[0]):
+            if faiss_id == -1 or score < SIMILARITY_THRESHOLD:
+                break
+            candidate = _id_to_key.get(int(faiss_id))
+            if candidate is None or _entries[candidate][1:3] != (schema_hash, literals):
+                continue
+            value = _lookup(candidate)
+            if value is not None:
+                return value
+    return None
+
+def put(query: str, schema_hash: str, value: dict) -> None:
+    """Store an answer for the query under both cache tiers.
+
+    Like get(), failures are logged and otherwise ignored.
+    """
+    try:
+        _put(query, schema_hash, value)
+    except Exception as e:
+        logger.warning("Response cache update failed: %s", e)
+
+def _put(query: str, schema_hash: str, value: dict) -> None:
+    global _index, _next_id
+    import faiss
+    import numpy as np
+    key = make_key(query, schema_hash)
+    vector = embed_query(normalize_query(query))
+    with _lock:
+        _remove(key)
+        _entries[key] = (time.monotonic(), schema_hash, query_literals(query), dict(value))
+
+        if _index is None:
+            _index = faiss.IndexIDMap2(faiss.IndexFlatIP(vector.shape[1]))
+        _index.add_with_ids(vector, np.array([_next_id], dtype="int64"))
+        _id_to_key[_next_id] = key
+        _key_to_id[key] = _next_id
+        _next_id += 1
+
+        while len(_entries) > MAX_ENTRIES:
+            _remove(next(iter(_entries)))
+
+def clear() -> None:
+    """Empty both cache tiers."""
+    global _index
+    with _lock:
+        _entries.clear()
+        _id_to_key.clear()
+        _key_to_id.clear()
+        _index = None
+
+@lru_cache(maxsize=None)
+def _disk_cache():
+    import diskcache
+    return diskcache.Cache(DISK_CACHE_DIR)
+
+def prompt_key(messages: list, *params) -> str:
+    """Hash a prompt, plus any model parameters that affect the response."""
+    payload = json.dumps([[(m.type, m.content) for m in messages], list(params)], sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def _invoke(runnable, messages: list):
+    return runnable.invoke(messages)
+
+def _invoke_key(llm, messages: list, schema=None) -> str:
+    return prompt_key(
+        messages, llm.model_name, llm.temperature, llm.max_tokens,
+        schema.__name__ if schema else None
+    )
+
+def _load(key: str, schema=None):
+    """Return the response persisted under key, or None on a miss.
+
+    Like the in-memory tiers, the disk tier is best-effort: an unusable
+    cache directory or a corrupt entry is logged and treated as a miss.
+    """
+    from langchain_core.messages import AIMessage
+
+    try:
+        stored = _disk_cache().get(key)
+        if stored is None:
+            return None
+        return schema.model_validate(stored) if schema else AIMessage(content=stored)
+    except Exception as e:
+        logger.warning("LLM disk cache lookup failed: %s", e)
+        return None
+
+def _store(key: str, value) -> None:
+    try:
+        _disk_cache().set(key, value)
+    except Exception as e:
+        logger.warning("LLM disk cache update failed: %s", e)
+
+def cached_invoke(llm, messages: list, schema=None, invoke=_invoke):
+    """Invoke the chat model, reusing responses persisted on disk for identical prompts.
+
+    With a pydantic schema the model is called with structured output and
+    the parsed object is returned; otherwise the AIMessage is returned.
+    invoke(runnable, messages) performs the actual call, e.g. with retries.
+    """
+    key = _invoke_key(llm, messages, schema)
+    stored = _load(key, schema)
+    if stored is not None:
+        return stored
+
+    if schema:
+        response = invoke(llm.with_structured_output(schema), messages)
+        _store(key, response.model_dump())
+    else:
+        response = invoke(llm, messages)
+        _store(key, response.content)
+    return response
+
+def discard_invoke(llm, messages: list, schema=None) -> None:
+    """Forget the persisted response to a prompt, e.g. once it turned out to be wrong."""
+    try:
+        _disk_cache().delete(_invoke_key(llm, messages, schema))
+    except Exception as e:
+        logger.warning("LLM disk cache update failed: %s", e)
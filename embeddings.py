@@ -0,0 +1,34 @@
+from functools import lru_cache
+from typing import TYPE_CHECKING
+
+# faiss, numpy and the embeddings client are only imported on first use
+if TYPE_CHECKING:
+    import numpy as np
+    from langchain_openai import OpenAIEmbeddings
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+@lru_cache(maxsize=None)
+def _embeddings() -> "OpenAIEmbeddings":
+    from langchain_openai import OpenAIEmbeddings
+    return OpenAIEmbeddings(model=EMBEDDING_MODEL)
+
+def _normalized(vectors: list[list[float]]) -> "np.ndarray":
+    import faiss
+    import numpy as np
+    array = np.array(vectors, dtype="float32")
+    faiss.normalize_L2(array)
+    return array
+
+@lru_cache(maxsize=1024)
+def embed_query(text: str) -> "np.ndarray":
+    """Embed a single text as a unit-length (1, dim) float32 array.
+
+    Results are memoized, so the response cache and the schema index
+    share one embedding call per question.
+    """
+    return _normalized([_embeddings().embed_query(text)])
+
+def embed_documents(texts: list[str]) -> "np.ndarray":
+    """Embed several texts as unit-length rows of an (n, dim) float32 array."""
+    return _normalized(_embeddings().embed_documents(texts))
@@ -2,12 +2,16 @@ from dotenv import load_dotenv
 from langgraph.graph import StateGraph, END
 from typing import TypedDict, Annotated
 import operator
+import httpx
+from functools import lru_cache
 from langchain_core.messages import AnyMessage, SystemMessage, HumanMessage
 from langchain_openai import ChatOpenAI
 from langgraph.checkpoint.sqlite import SqliteSaver
-from langchain_community.database import SQLDatabase
-from langchain_experimental.sql import SQLDatabaseChain
+from langchain_community.utilities.sql_database import SQLDatabase
+from tabulate import tabulate
+from sql_agent import split_sqlite_statements
 import os
+import asyncio
 import warnings
 warnings.filterwarnings("ignore")
 
@@ -25,13 +29,29 @@ class SQLState(TypedDict):
     error: str
 
 # Initialize components
-llm = ChatOpenAI(model="gpt-3.5-turbo", temperature=0.7)
-db = SQLDatabase.from_uri(DB_URL)
-db_chain = SQLDatabaseChain.from_llm(
-    llm=llm,
-    database=db,
-    verbose=True
+# Share one pool of warm HTTP/2 connections across every LLM call
+HTTP_LIMITS = httpx.Limits(max_connections=64, max_keepalive_connections=32)
+http_client = httpx.Client(http2=True, limits=HTTP_LIMITS)
+http_async_client = httpx.AsyncClient(http2=True, limits=HTTP_LIMITS)
+
+# Deterministic model for generating and correcting SQL
+sql_llm = ChatOpenAI(
+    model="gpt-4o-mini",
+    temperature=0,
+    seed=42,
+    max_tokens=512,
+    http_client=http_client,
+    http_async_client=http_async_client
+)
+explain_llm = ChatOpenAI(
+    model="gpt-3.5-turbo",
+    temperature=0.7,
+    max_tokens=300,
+    streaming=True,
+    http_client=http_client,
+    http_async_client=http_async_client
 )
+db = SQLDatabase.from_uri(DB_URL)
 
 # Define prompts
 QUERY_PROMPT = """You are a SQL query generator. Given a natural language question, generate a SQL query that answers it.
@@ -50,38 +70,63 @@ Original question: {query}
 Failed query: {sql}
 Corrected SQL query:"""
 
+@lru_cache(maxsize=None)
 def get_schema() -> str:
     """Get the database schema description."""
     return db.get_table_info()
 
+def invalidate_schema() -> None:
+    """Drop the cached schema description, e.g. after running DDL."""
+    get_schema.cache_clear()
+
 def query_node(state: SQLState) -> dict[str, str]:
     """Generate SQL query from natural language."""
-    schema = state.get('schema', get_schema())
+    schema = state['schema']
     messages = [
         SystemMessage(content=QUERY_PROMPT.format(schema=schema, query=state['query']))
     ]
-    response = llm.invoke(messages)
+    response = sql_llm.invoke(messages)
     return {'sql': response.content}
 
-def execute_node(state: SQLState) -> dict[str, str]:
-    """Execute the SQL query and get results."""
+def run_sql(sql: str) -> dict[str, str]:
+    """Run the SQL directly against the database, one statement at a time in one transaction."""
     try:
-        result = db_chain.run(state['sql'])
-        return {'result': result}
+        results = []
+        with db._engine.begin() as conn:
+            for statement in split_sqlite_statements(sql):
+                cursor = conn.exec_driver_sql(statement)
+                if cursor.returns_rows:
+                    results.append(tabulate(cursor.fetchall(), headers=list(cursor.keys()), tablefmt='github'))
+                else:
+                    results.append(f"{cursor.rowcount} row(s) affected")
+        return {'result': '\n'.join(results), 'error': ''}
     except Exception as e:
         return {'error': str(e)}
 
-def explain_node(state: SQLState) -> dict[str, str]:
+async def execute_node(state: SQLState) -> dict[str, str]:
+    """Execute the SQL query without blocking the event loop."""
+    return await asyncio.to_thread(run_sql, state['sql'])
+
+async def explain_node(state: SQLState) -> dict[str, str]:
     """Generate an explanation of the query."""
     messages = [
         SystemMessage(content=EXPLANATION_PROMPT.format(sql=state['sql']))
     ]
-    response = llm.invoke(messages)
+    response = await explain_llm.ainvoke(messages)
     return {'explanation': response.content}
 
+async def execute_and_explain_node(state: SQLState) -> dict[str, str]:
+    """Execute the SQL query and explain it concurrently.
+
+    The explanation only depends on the SQL text, so its LLM call is
+    hidden behind the query execution.
+    """
+    executed, explained = await asyncio.gather(execute_node(state), explain_node(state))
+    return {**executed, **explained}
+
 def error_handling_node(state: SQLState) -> dict[str, str]:
     """Handle query errors by generating a corrected query."""
-    schema = state.get('schema', get_schema())
+    schema = state['schema']
     messages = [
         SystemMessage(content=ERROR_HANDLING_PROMPT.format(
             error=state['error'],
@@ -90,7 +135,7 @@ def error_handling_node(state: SQLState) -> dict[str, str]:
             sql=state['sql']
         ))
     ]
-    response = llm.invoke(messages)
+    response = sql_llm.invoke(messages)
     return {'sql': response.content}
 
 def create_sql_agent() -> StateGraph[SQLState]:
@@ -99,8 +144,7 @@ def create_sql_agent() -> StateGraph[SQLState]:
     
     # Add nodes
     builder.add_node("query", query_node)
-    builder.add_node("execute", execute_node)
-    builder.add_node("explain", explain_node)
+    builder.add_node("execute", execute_and_explain_node)
     builder.add_node("error_handling", error_handling_node)
     
     # Set entry point
@@ -109,17 +153,44 @@ def create_sql_agent() -> StateGraph[SQLState]:
     # Add edges
     builder.add_edge("query", "execute")
     builder.add_conditional_edges("execute", 
-        lambda state: state.get('error'),
-        {True: "error_handling", False: "explain"}
+        lambda state: bool(state.get('error')),
+        {True: "error_handling", False: END}
     )
     builder.add_edge("error_handling", "execute")
     
     # Compile the graph
     return builder.compile()
 
+async def run_agent(agent, state: SQLState) -> dict:
+    """Run the agent, printing the SQL and streaming its explanation as they arrive."""
+    result = state
+    explaining_step = None
+    async for mode, chunk in agent.astream(state, stream_mode=["values", "messages"]):
+        if mode == "values":
+            if chunk.get('sql') and chunk.get('sql') != result.get('sql'):
+                print("\nGenerated SQL:", chunk['sql'])
+            result = chunk
+            continue
+        
+        # Only stream tokens from the explanation, which runs in the execute node
+        message, metadata = chunk
+        if metadata.get('langgraph_node') != 'execute' or not message.content:
+            continue
+        if metadata.get('langgraph_step') != explaining_step:
+            explaining_step = metadata.get('langgraph_step')
+            print("\nExplanation: ", end='')
+        print(message.content, end='', flush=True)
+    
+    if explaining_step is not None:
+        print()
+    return result
+
 def main():
     """Run the SQL agent."""
     agent = create_sql_agent()
+    schema = get_schema()
+    # Keep one event loop so the shared async HTTP client stays usable
+    loop = asyncio.new_event_loop()
     
     print("Welcome to the Text-to-SQL Agent!")
     print("Type 'exit' to quit.")
@@ -132,121 +203,16 @@ def main():
         # Initialize state
         state = {
             'query': query,
-            'schema': get_schema()
+            'schema': schema
         }
         
         # Run the agent
-        result = agent.invoke(state)
+        result = loop.run_until_complete(run_agent(agent, state))
         
         # Display results
-        print("\nGenerated SQL:", result.get('sql', 'N/A'))
-        print("\nExplanation:", result.get('explanation', 'N/A'))
         print("\nResult:", result.get('result', 'N/A'))
-        if 'error' in result:
+        if result.get('error'):
             print("\nError:", result['error'])
 
 if __name__ == "__main__":
-    main() 
-
-REFLECTION_PROMPT = """You are a teacher grading an essay submission. \
-Generate critique and recommendations for the user's submission. \
-Provide detailed recommendations, including requests for length, depth, style, etc."""
-
-RESEARCH_PLAN_PROMPT = """You are a researcher charged with providing information that can \
-be used when writing the following essay. Generate a list of search queries that will gather \
-any relevant information. Only generate 3 queries max."""
-
-RESEARCH_CRITIQUE_PROMPT = """You are a researcher charged with providing information that can \
-be used when making any requested revisions (as outlined below). \
-Generate a list of search queries that will gather any relevant information. Only generate 3 queries max."""
-
-
-class Queries(BaseModel):
-    queries: List[str]
-
-def plan_node(state: AgentState):
-    messages = [
-        SystemMessage(content=PLAN_PROMPT), 
-        HumanMessage(content=state['task'])
-    ]
-    response = model.invoke(messages)
-    return {"plan": response.content}
-
-def research_plan_node(state: AgentState):
-    queries = model.with_structured_output(Queries).invoke([
-        SystemMessage(content=RESEARCH_PLAN_PROMPT),
-        HumanMessage(content=state['task'])
-    ])
-    content = state['content'] or []
-    for q in queries.queries:
-        response = tavily.search(query=q, max_results=2)
-        for r in response['results']:
-            content.append(r['content'])
-    return {"content": content}
-
-def generation_node(state: AgentState):
-    content = "\n\n".join(state['content'] or [])
-    user_message = HumanMessage(
-        content=f"{state['task']}\n\nHere is my plan:\n\n{state['plan']}")
-    messages = [
-        SystemMessage(
-            content=WRITER_PROMPT.format(content=content)
-        ),
-        user_message
-        ]
-    response = model.invoke(messages)
-    return {
-        "draft": response.content, 
-        "revision_number": state.get("revision_number", 1) + 1
-    }
-
-def reflection_node(state: AgentState):
-    messages = [
-        SystemMessage(content=REFLECTION_PROMPT), 
-        HumanMessage(content=state['draft'])
-    ]
-    response = model.invoke(messages)
-    return {"critique": response.content}
-
-def research_critique_node(state: AgentState):
-    queries = model.with_structured_output(Queries).invoke([
-        SystemMessage(content=RESEARCH_CRITIQUE_PROMPT),
-        HumanMessage(content=state['critique'])
-    ])
-    content = state['content'] or []
-    for q in queries.queries:
-        response = tavily.search(query=q, max_results=2)
-        for r in response['results']:
-            content.append(r['content'])
-    return {"content": content}
-
-def should_continue(state):
-    if state["revision_number"] > state["max_revisions"]:
-        return END
-    return "reflect"
-
-builder = StateGraph(AgentState)
-
-builder.add_node("planner", plan_node)
-builder.add_node("generate", generation_node)
-builder.add_node("reflect", reflection_node)
-builder.add_node("research_plan", research_plan_node)
-builder.add_node("research_critique", research_critique_node)
-
-builder.set_entry_point("planner")
-
-builder.add_conditional_edges(
-    "generate", 
-    should_continue, 
-    {END: END, "reflect": "reflect"}
-)
-
-
-builder.add_edge("planner", "research_plan")
-builder.add_edge("research_plan", "generate")
-
-builder.add_edge("reflect", "research_critique")
-builder.add_edge("research_critique", "generate")
-
-graph = builder.compile(checkpointer=memory)
-
+    main()
@@ -0,0 +1,119 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI
+from pydantic import BaseModel
+
+from sql_agent import (
+    SQLState,
+    SQLWithExplanation,
+    ainvoke_llm,
+    build_query_messages,
+    create_sql_agent,
+    get_cached_query,
+    get_llm,
+    get_schema,
+    parse_query_response,
+)
+
+# Batching settings
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "8"))
+LLM_BATCH_TIMEOUT_MS = int(os.getenv("LLM_BATCH_TIMEOUT_MS", "50"))
+
+class QueryBatcher:
+    """Collect concurrent SQL generation requests into batched LLM calls.
+
+    A batch is sent once it holds max_batch_size requests or timeout_ms
+    has passed since its first request arrived, whichever comes first.
+    """
+
+    def __init__(self, max_batch_size: int, timeout_ms: int):
+        self.max_batch_size = max_batch_size
+        self.timeout = timeout_ms / 1000
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.generator = get_llm().with_structured_output(SQLWithExplanation)
+
+    async def submit(self, messages: list) -> SQLWithExplanation:
+        """Queue a prompt and wait for its response."""
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((messages, future))
+        return await future
+
+    async def _next_batch(self) -> list:
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        deadline = loop.time() + self.timeout
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def run(self):
+        """Drain the queue forever, one batch at a time."""
+        while True:
+            batch = await self._next_batch()
+            # Failed items are retried individually with jittered backoff;
+            # errors are collected per item so one bad request cannot stall the rest
+            responses = await asyncio.gather(
+                *(ainvoke_llm(self.generator, messages) for messages, _ in batch),
+                return_exceptions=True
+            )
+            for (_, future), response in zip(batch, responses):
+                if future.done():
+                    continue
+                if isinstance(response, Exception):
+                    future.set_exception(response)
+                else:
+                    future.set_result(response)
+
+batcher = QueryBatcher(MAX_BATCH_SIZE, LLM_BATCH_TIMEOUT_MS)
+
+async def batched_query_node(state: SQLState) -> dict[str, str]:
+    """Generate SQL query from natural language through the shared batcher."""
+    cached = await asyncio.to_thread(get_cached_query, state)
+    if cached is not None:
+        return cached
+
+    response = await batcher.submit(build_query_messages(state))
+    return parse_query_response(response)
+
+agent = create_sql_agent(generate_sql=batched_query_node)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    task = asyncio.create_task(batcher.run())
+    yield
+    task.cancel()
+
+app = FastAPI(title="Text-to-SQL Agent", lifespan=lifespan)
+
+class AskRequest(BaseModel):
+    query: str
+
+class AskResponse(BaseModel):
+    sql: str = ''
+    explanation: str = ''
+    result: str = ''
+    error: str = ''
+
+@app.post("/ask", response_model=AskResponse)
+async def ask(request: AskRequest) -> AskResponse:
+    """Answer a natural language question about the database."""
+    state = SQLState(
+        query=request.query,
+        sql='',
+        result='',
+        explanation='',
+        schema=get_schema(),
+        error='',
+        retry_count=0,
+        validation_error=''
+    )
+    result = await agent.ainvoke(state)
+    return AskResponse(**{key: result.get(key) or '' for key in AskResponse.model_fields})
@@ -7,6 +7,14 @@ db_path = "example.db"
 conn = sqlite3.connect(db_path)
 cursor = conn.cursor()
 
+# Use write-ahead logging and relaxed syncing for faster reads and writes
+cursor.executescript("""
+    PRAGMA journal_mode=WAL;
+    PRAGMA synchronous=NORMAL;
+    PRAGMA temp_store=MEMORY;
+    PRAGMA mmap_size=268435456;
+""")
+
 # Create tables
 # Example tables: customers, orders, and products
 cursor.execute('''
@@ -60,11 +68,6 @@ customers_data = [
     ('Bob Johnson', 'bob@example.com', '555-0125', '789 Pine St')
 ]
 
-cursor.executemany('''
-    INSERT INTO customers (name, email, phone, address)
-    VALUES (?, ?, ?, ?)
-''', customers_data)
-
 # Products
 products_data = [
     ('Laptop', 'High-performance laptop', 999.99, 10),
@@ -73,13 +76,19 @@ products_data = [
     ('Headphones', 'Wireless headphones', 199.99, 30)
 ]
 
-cursor.executemany('''
-    INSERT INTO products (name, description, price, stock_quantity)
-    VALUES (?, ?, ?, ?)
-''', products_data)
+# Insert everything in one transaction so it is committed with a single sync
+with conn:
+    cursor.executemany('''
+        INSERT INTO customers (name, email, phone, address)
+        VALUES (?, ?, ?, ?)
+    ''', customers_data)
+
+    cursor.executemany('''
+        INSERT INTO products (name, description, price, stock_quantity)
+        VALUES (?, ?, ?, ?)
+    ''', products_data)
 
-# Commit changes and close connection
-conn.commit()
+# Close connection
 conn.close()
 
 print(f"Database created at {db_path}")
@@ -1,17 +1,34 @@
+from __future__ import annotations
+
 from dotenv import load_dotenv
-from langgraph.graph import StateGraph, END
-from typing import TypedDict, Annotated
-import operator
-from langchain_core.messages import AnyMessage, SystemMessage, HumanMessage
-from langchain_openai import ChatOpenAI
-from langgraph.checkpoint.sqlite import SqliteSaver
-from langchain_community.utilities.sql_database import SQLDatabase
-from langchain_experimental.sql import SQLDatabaseChain
+from functools import lru_cache
+from threading import Lock
+from typing import TYPE_CHECKING, Callable, Optional, TypedDict
+from pydantic import BaseModel, Field
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_random_exponential
+import logging
 import warnings
 import os
 import sys
+import cache
+from embeddings import embed_documents, embed_query
 warnings.filterwarnings("ignore")
 
+# sqlglot warns each time it keeps a statement it cannot parse, e.g. EXPLAIN
+# QUERY PLAN, as a raw command. The validator handles those, so the warning
+# is only noise on the CLI user's terminal.
+logging.getLogger("sqlglot").addFilter(
+    lambda record: "Falling back to parsing as a 'Command'" not in record.getMessage()
+)
+
+# Heavy LangChain/LangGraph/SQLAlchemy imports are deferred until first use
+# so that the CLI starts instantly
+if TYPE_CHECKING:
+    from langchain_community.utilities.sql_database import SQLDatabase
+    from langchain_core.messages import AnyMessage, SystemMessage
+    from langchain_openai import ChatOpenAI
+    from langgraph.graph import StateGraph
+
 _ = load_dotenv()
 
 # Load environment variables
@@ -24,135 +41,704 @@ class SQLState(TypedDict):
     explanation: str
     schema: str
     error: str
+    retry_count: int
+    validation_error: str
+
+class SQLWithExplanation(BaseModel):
+    sql: str = Field(description="The SQL query, without markdown fences")
+    explanation: str = Field(description="A plain-English explanation of the SQL query")
+
+SQLITE_PRAGMAS = """
+PRAGMA journal_mode=WAL;
+PRAGMA synchronous=NORMAL;
+PRAGMA temp_store=MEMORY;
+PRAGMA mmap_size=268435456;
+"""
+
+def create_db_engine(url: str):
+    """Create the database engine, tuning SQLite connections for a read-heavy workload."""
+    from sqlalchemy import create_engine, event
+    from sqlalchemy.pool import StaticPool
+    
+    if not url.startswith("sqlite"):
+        return create_engine(url)
+    
+    # Pooled connections are handed to worker threads by the server. A
+    # single shared connection is only needed to keep an in-memory
+    # database alive, since each connection would otherwise get its own.
+    in_memory = url in ("sqlite://", "sqlite:///") or ":memory:" in url or "mode=memory" in url
+    engine = create_engine(
+        url,
+        connect_args={"check_same_thread": False},
+        **({"poolclass": StaticPool} if in_memory else {})
+    )
+    
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        dbapi_connection.executescript(SQLITE_PRAGMAS)
+    
+    return engine
+
+# Output token budgets; SQL is rarely longer than this and a runaway
+# response should not stall the agent
+SQL_MAX_TOKENS = 512
+EXPLANATION_MAX_TOKENS = 300
+
+# Give up on a question after this many corrected queries have failed
+MAX_QUERY_RETRIES = 3
+
+def is_transient_error(error: BaseException) -> bool:
+    """Whether an OpenAI error is worth retrying with backoff.
 
-# Initialize components
-llm = ChatOpenAI(model="gpt-3.5-turbo", temperature=0.7)
-db = SQLDatabase.from_uri(DB_URL)
-db_chain = SQLDatabaseChain.from_llm(
-    llm, db
+    These are the failures the OpenAI client would itself retry: rate
+    limits, dropped connections and timeouts, 408, 409 and 5xx responses.
+    """
+    import openai
+    
+    if isinstance(error, (openai.RateLimitError, openai.APIConnectionError,
+                          openai.ConflictError, openai.InternalServerError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code == 408
+
+_backoff = wait_random_exponential(multiplier=0.5, max=10)
+
+def wait_for_retry(retry_state) -> float:
+    """Back off with jitter, but never sooner than the server's Retry-After."""
+    response = getattr(retry_state.outcome.exception(), 'response', None)
+    try:
+        retry_after = float(response.headers.get('retry-after', 0)) if response is not None else 0
+    except ValueError:
+        retry_after = 0
+    return max(_backoff(retry_state), min(retry_after, 60))
+
+retry_llm = retry(
+    wait=wait_for_retry,
+    retry=retry_if_exception(is_transient_error),
+    stop=stop_after_attempt(5),
+    reraise=True
 )
 
+@retry_llm
+def invoke_llm(runnable, messages: list[AnyMessage]):
+    """Invoke an LLM runnable, backing off with jitter on transient errors."""
+    return runnable.invoke(messages)
+
+@retry_llm
+async def ainvoke_llm(runnable, messages: list[AnyMessage]):
+    """Async invoke_llm."""
+    return await runnable.ainvoke(messages)
+
+# Initialize components on first use
+@lru_cache(maxsize=None)
+def get_llm() -> ChatOpenAI:
+    """Get the shared chat model."""
+    import httpx
+    from langchain_openai import ChatOpenAI
+    
+    # Share one pool of warm HTTP/2 connections across every LLM call
+    limits = httpx.Limits(max_connections=64, max_keepalive_connections=32)
+    # Deterministic output keeps repeated questions cacheable; retries are
+    # handled by invoke_llm and ainvoke_llm rather than the OpenAI client
+    return ChatOpenAI(
+        model="gpt-4o-mini",
+        temperature=0,
+        seed=42,
+        max_retries=0,
+        # SQL and its explanation come back in one structured response
+        max_tokens=SQL_MAX_TOKENS + EXPLANATION_MAX_TOKENS,
+        http_client=httpx.Client(http2=True, limits=limits),
+        http_async_client=httpx.AsyncClient(http2=True, limits=limits)
+    )
+
+# Swapped out by refresh_schema, so it is guarded rather than lru_cached:
+# concurrent first calls must not each build (and leak) an engine
+_DB: Optional[SQLDatabase] = None
+_DB_LOCK = Lock()
+
+def connect_db() -> SQLDatabase:
+    """Open a new database handle, reflecting the current tables."""
+    from langchain_community.utilities.sql_database import SQLDatabase
+    
+    return SQLDatabase(create_db_engine(DB_URL), sample_rows_in_table_info=0)
+
+def get_db() -> SQLDatabase:
+    """Get the shared database handle."""
+    global _DB
+    if _DB is None:
+        with _DB_LOCK:
+            if _DB is None:
+                _DB = connect_db()
+    return _DB
+
+# Send only the most relevant tables once the schema has more than this many
+SCHEMA_TOP_K = int(os.getenv("SCHEMA_TOP_K", "5"))
+
 # Define prompts
-QUERY_PROMPT = """You are a SQL query generator. Given a natural language question, generate a SQL query that answers it.
-Database schema: {schema}
-Question: {query}
-Generated SQL query:"""
-
-EXPLANATION_PROMPT = """Explain the SQL query in simple terms:
-Query: {sql}
-Explanation:"""
-
-ERROR_HANDLING_PROMPT = """The previous query failed with error: {error}
-Please analyze the error and generate a corrected SQL query.
-Database schema: {schema}
-Original question: {query}
+SYSTEM_PROMPT = """You are a SQL query generator. Given a natural language question, generate a SQL query that answers it,
+and explain the SQL query in simple terms. If a previous query failed, analyze the error and generate a corrected query.
+Database schema, one table per line as table(column:type, ...):
+{schema}"""
+
+ERROR_HANDLING_PROMPT = """Original question: {query}
 Failed query: {sql}
-Corrected SQL query:"""
+Error: {error}
+Please analyze the error, generate a corrected SQL query and explain the corrected query in simple terms."""
+
+VALIDATION_PROMPT = """Your previous SQL query was rejected before it was run.
+Rejected query: {sql}
+Problem: {validation_error}
+Generate a corrected SQL query that only uses tables and columns from the schema, and explain it in simple terms."""
+
+def compact_table(table) -> str:
+    """Describe a table as name(column:type [pk] [unique] [-> table.column], ...)."""
+    from sqlalchemy import UniqueConstraint
+    
+    unique = {
+        constraint.columns.keys()[0] for constraint in table.constraints
+        if isinstance(constraint, UniqueConstraint) and len(constraint.columns) == 1
+    }
+    columns = []
+    for column in table.columns:
+        try:
+            type_name = column.type.python_type.__name__
+        except NotImplementedError:
+            type_name = str(column.type).lower()
+        
+        parts = [f"{column.name}:{type_name}"]
+        if column.primary_key:
+            parts.append("pk")
+        if column.unique or column.name in unique:
+            parts.append("unique")
+        parts.extend(f"-> {fk.target_fullname}" for fk in column.foreign_keys)
+        columns.append(" ".join(parts))
+    return f"{table.name}({', '.join(columns)})"
+
+def usable_tables() -> list:
+    """Get the reflected metadata of every table the agent may query."""
+    db = get_db()
+    usable = set(db.get_usable_table_names())
+    return [table for table in db._metadata.sorted_tables if table.name in usable]
+
+# The schema is rendered once, on first use; it is static for the lifetime
+# of the agent. Every LLM call starts with the same system message so
+# OpenAI's prompt prefix cache can reuse it across questions.
+_SCHEMA_INFO: Optional[str] = None
+_TABLE_LINES: list[str] = []
+_TABLE_COLUMNS: dict[str, set[str]] = {}
+_TABLE_INDEX = None
+_SYSTEM_MESSAGE: Optional[SystemMessage] = None
+
+def build_system_message(schema: str) -> SystemMessage:
+    """Build the system message for SQL generation over the given schema."""
+    from langchain_core.messages import SystemMessage
+    
+    return SystemMessage(content=SYSTEM_PROMPT.format(schema=schema))
+
+def _render_schema() -> None:
+    global _SCHEMA_INFO, _TABLE_LINES, _TABLE_COLUMNS, _TABLE_INDEX, _SYSTEM_MESSAGE
+    tables = usable_tables()
+    _TABLE_LINES = [compact_table(table) for table in tables]
+    _TABLE_COLUMNS = {table.name: {column.name for column in table.columns} for table in tables}
+    schema = "\n".join(_TABLE_LINES)
+    if schema != _SCHEMA_INFO:
+        _SCHEMA_INFO = schema
+        _SYSTEM_MESSAGE = build_system_message(_SCHEMA_INFO)
+        _TABLE_INDEX = None
 
 def get_schema() -> str:
     """Get the database schema description."""
-    return db.get_table_info()
+    if _SCHEMA_INFO is None:
+        _render_schema()
+    return _SCHEMA_INFO
 
-def query_node(state: SQLState) -> dict[str, str]:
-    """Generate SQL query from natural language."""
-    schema = state.get('schema', get_schema())
+def refresh_schema() -> str:
+    """Re-reflect the database and rebuild the schema description, e.g. after running DDL.
+
+    SQLDatabase fixes its list of usable tables when it is constructed, so
+    the handle is rebuilt rather than just re-reflected. Connections other
+    threads still hold on the old engine are closed when they are returned.
+    """
+    global _DB
+    with _DB_LOCK:
+        old_db, _DB = _DB, connect_db()
+    if old_db is not None:
+        old_db._engine.dispose()
+    _render_schema()
+    return _SCHEMA_INFO
+
+def _get_table_index():
+    """Embed every table description once into an inner-product index."""
+    global _TABLE_INDEX
+    if _TABLE_INDEX is None:
+        import faiss
+        
+        vectors = embed_documents(_TABLE_LINES)
+        index = faiss.IndexFlatIP(vectors.shape[1])
+        index.add(vectors)
+        _TABLE_INDEX = index
+    return _TABLE_INDEX
+
+def relevant_schema(query: str) -> str:
+    """Get the schema of the tables most relevant to the question.
+
+    Schemas with at most SCHEMA_TOP_K tables are returned whole, which
+    keeps the system message identical across calls.
+    """
+    schema = get_schema()
+    if len(_TABLE_LINES) <= SCHEMA_TOP_K:
+        return schema
+    
+    _, ids = _get_table_index().search(embed_query(cache.normalize_query(query)), SCHEMA_TOP_K)
+    return "\n".join(_TABLE_LINES[i] for i in sorted(ids[0]) if i != -1)
+
+def get_system_message(query: str) -> SystemMessage:
+    """Get the system message for a question."""
+    schema = relevant_schema(query)
+    if schema is _SCHEMA_INFO:
+        return _SYSTEM_MESSAGE
+    return build_system_message(schema)
+
+def get_table_columns() -> dict[str, set[str]]:
+    """Get the column names of every usable table."""
+    if _SCHEMA_INFO is None:
+        _render_schema()
+    return _TABLE_COLUMNS
+
+def get_cached_query(state: SQLState) -> Optional[dict[str, str]]:
+    """Reuse the answer to an identical or near-identical earlier question."""
+    # A rejected query needs a fresh answer
+    if state.get('validation_error'):
+        return None
+    return cache.get(state['query'], cache.schema_hash(state['schema']))
+
+def build_query_messages(state: SQLState) -> list[AnyMessage]:
+    """Build the prompt for generating SQL from natural language."""
+    from langchain_core.messages import HumanMessage
+    
     messages = [
-        SystemMessage(content=QUERY_PROMPT.format(schema=schema, query=state['query']))
+        get_system_message(state['query']),
+        HumanMessage(content=state['query'])
     ]
-    response = llm.invoke(messages)
-    
+    if state.get('validation_error'):
+        messages.append(HumanMessage(content=VALIDATION_PROMPT.format(
+            sql=state['sql'],
+            validation_error=state['validation_error']
+        )))
+    return messages
+
+def parse_query_response(response: SQLWithExplanation) -> dict[str, str]:
+    """Turn a structured LLM response into a state update."""
     # Ensure we have a valid SQL query
-    sql = response.content.strip()
+    sql = response.sql.strip()
     if not sql:
         return {'error': 'No SQL query generated'}
     
-    # Return the SQL query
-    return {'sql': sql}
+    # Return the SQL query along with its explanation
+    return {'sql': sql, 'explanation': response.explanation.strip()}
 
-def execute_node(state: SQLState) -> dict[str, str]:
-    """Execute the SQL query and get results."""
+def query_node(state: SQLState) -> dict[str, str]:
+    """Generate SQL query from natural language."""
+    cached = get_cached_query(state)
+    if cached is not None:
+        return cached
+    
+    messages = build_query_messages(state)
+    if state.get('validation_error'):
+        # Retries must reach the model; a persisted answer would repeat the rejected SQL
+        response = invoke_llm(get_llm().with_structured_output(SQLWithExplanation), messages)
+    else:
+        response = cache.cached_invoke(get_llm(), messages, SQLWithExplanation, invoke_llm)
+    return parse_query_response(response)
+
+def discard_cached_query(state: SQLState) -> None:
+    """Forget the persisted answer to the question once its SQL has failed."""
+    messages = build_query_messages({**state, 'validation_error': ''})
+    cache.discard_invoke(get_llm(), messages, SQLWithExplanation)
+
+def format_rows(columns, rows) -> str:
+    """Render result rows as a table."""
+    from tabulate import tabulate
+    
+    return tabulate(rows, headers=list(columns), tablefmt='github')
+
+def split_sqlite_statements(sql: str) -> list[str]:
+    """Split a script into statements.
+
+    Statement ends are found with SQLite's own tokenizer
+    (sqlite3.complete_statement), so semicolons inside string literals
+    and comments do not split a statement.
+    """
+    import sqlite3
+    
+    statements = []
+    current = ''
+    *pieces, tail = sql.split(';')
+    for piece in pieces:
+        current += piece + ';'
+        if sqlite3.complete_statement(current):
+            statements.append(current.strip())
+            current = ''
+    current += tail
+    if current.strip():
+        statements.append(current.strip())
+    return statements
+
+def first_keyword(statement: str) -> str:
+    """Get the first keyword of a statement, skipping leading comments."""
+    text = statement.lstrip()
+    while text.startswith(('--', '/*')):
+        line_comment = text.startswith('--')
+        end = text.find('\n' if line_comment else '*/')
+        text = '' if end == -1 else text[end + (1 if line_comment else 2):].lstrip()
+    return text.split(None, 1)[0].rstrip(';').upper() if text else ''
+
+def run_sqlite(sql: str) -> str:
+    """Run SQL through SQLite's native API, one statement at a time in one transaction."""
+    conn = get_db()._engine.raw_connection()
     try:
-        # Split SQL statements by semicolon
-        statements = [stmt.strip() for stmt in state['sql'].split(';') if stmt.strip()]
+        cursor = conn.cursor()
         results = []
-        
-        # Execute each statement separately
+        cursor.execute("BEGIN")
+        try:
+            for statement in split_sqlite_statements(sql):
+                # The script already runs in one transaction; its own
+                # BEGIN would fail as nested and its COMMIT would end ours
+                if first_keyword(statement) in ('BEGIN', 'COMMIT', 'END'):
+                    continue
+                cursor.execute(statement)
+                if cursor.description is not None:
+                    columns = [column[0] for column in cursor.description]
+                    results.append(format_rows(columns, cursor.fetchall()))
+                elif cursor.rowcount >= 0:
+                    results.append(f"{cursor.rowcount} row(s) affected")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return '\n'.join(results) or "Query executed"
+    finally:
+        conn.close()
+
+def run_statements(sql: str) -> str:
+    """Run SQL on other databases, one statement at a time in one transaction."""
+    # Split SQL statements by semicolon
+    statements = [stmt.strip() for stmt in sql.split(';') if stmt.strip()]
+    results = []
+    with get_db()._engine.begin() as conn:
         for stmt in statements:
-            try:
-                result = db_chain.run(stmt)
-                results.append(result)
-            except Exception as e:
-                return {'error': f"Error executing statement: {stmt}\nError: {str(e)}"}
-                
-        return {'result': '\n'.join(results)}
+            cursor = conn.exec_driver_sql(stmt)
+            if cursor.returns_rows:
+                results.append(format_rows(cursor.keys(), cursor.fetchall()))
+            else:
+                results.append(f"{cursor.rowcount} row(s) affected")
+    return '\n'.join(results)
+
+def get_sqlglot_dialect() -> str:
+    """Map the database dialect to sqlglot's name for it."""
+    dialect = get_db().dialect
+    return {'postgresql': 'postgres'}.get(dialect, dialect)
+
+def is_read_only(sql: str, dialect: str = 'sqlite') -> bool:
+    """Whether every statement in the SQL is a query that only reads data."""
+    import sqlglot
+    from sqlglot import exp
+    
+    try:
+        statements = [statement for statement in sqlglot.parse(sql, read=dialect) if statement is not None]
+    except sqlglot.errors.ParseError:
+        return False
+    return bool(statements) and all(isinstance(statement, exp.Query) for statement in statements)
+
+def changes_schema(sql: str, dialect: str = 'sqlite') -> bool:
+    """Whether the SQL may create, drop or alter tables."""
+    import sqlglot
+    from sqlglot import exp
+    
+    ddl = tuple(getattr(exp, name) for name in ('Create', 'Drop', 'Alter', 'AlterTable') if hasattr(exp, name))
+    try:
+        statements = [statement for statement in sqlglot.parse(sql, read=dialect) if statement is not None]
+    except sqlglot.errors.ParseError:
+        # The database accepted it, so assume the worst
+        return True
+    return any(
+        isinstance(statement, ddl)
+        # Statements sqlglot cannot parse, e.g. CREATE TRIGGER, are kept as raw commands
+        or (isinstance(statement, exp.Command) and statement.this.upper() in ('CREATE', 'DROP', 'ALTER'))
+        for statement in statements
+    )
+
+def execute_node(state: SQLState) -> dict[str, str]:
+    """Execute the SQL query and get results."""
+    try:
+        if get_db().dialect == 'sqlite':
+            result = run_sqlite(state['sql'])
+        else:
+            result = run_statements(state['sql'])
     except Exception as e:
-        return {'error': str(e)}
+        discard_cached_query(state)
+        return {'error': f"Error executing query: {state['sql']}\nError: {str(e)}"}
+    
+    # Only reads are cached: replaying "delete order 12" for a repeated
+    # question would run it twice. Similar questions only share an answer
+    # when their literals match too, see cache.get. DDL changes the schema
+    # that later questions are validated against.
+    dialect = get_sqlglot_dialect()
+    if changes_schema(state['sql'], dialect):
+        refresh_schema()
+    elif is_read_only(state['sql'], dialect):
+        cache.put(state['query'], cache.schema_hash(state['schema']), {
+            'sql': state['sql'],
+            'explanation': state['explanation']
+        })
+    return {'result': result, 'error': ''}
 
-def explain_node(state: SQLState) -> dict[str, str]:
-    """Generate an explanation of the query."""
-    messages = [
-        SystemMessage(content=EXPLANATION_PROMPT.format(sql=state['sql']))
-    ]
-    response = llm.invoke(messages)
-    return {'explanation': response.content}
+# Columns SQLite provides on every ordinary table without declaring them
+IMPLICIT_COLUMNS = {'rowid', 'oid', '_rowid_'}
 
-def error_handling_node(state: SQLState) -> dict[str, str]:
+# sqlglot expression types that are whole statements rather than bare expressions
+STATEMENT_TYPES = (
+    'Query', 'Values', 'Insert', 'Update', 'Delete', 'Create', 'Drop', 'Alter', 'AlterTable',
+    'Pragma', 'Transaction', 'Commit', 'Rollback', 'Analyze', 'Attach', 'Detach',
+    'Command', 'EndStatement'
+)
+
+def validate_sql(sql: str, tables: dict[str, set[str]], dialect: str = 'sqlite') -> Optional[str]:
+    """Check generated SQL offline, without touching the database.
+
+    Returns a description of the first problem found, or None if the SQL
+    parses into real statements and every table and column it names
+    exists in tables. Column references that cannot be resolved
+    statically, e.g. through CTEs, subqueries or table-valued functions,
+    are given the benefit of the doubt.
+    """
+    import sqlglot
+    from sqlglot import exp
+    
+    try:
+        statements = sqlglot.parse(sql, read=dialect)
+    except sqlglot.errors.ParseError as e:
+        error = e.errors[0] if e.errors else {}
+        return (
+            f"Syntax error at line {error.get('line', '?')}, column {error.get('col', '?')}: "
+            f"{error.get('description', 'invalid SQL')}"
+        )
+    
+    # sqlglot parses stray text such as "SELEC x" or a markdown fence as a
+    # bare expression, so only real statements are let through. Older
+    # sqlglot releases lack some of these classes, or name them differently.
+    statement_types = tuple(getattr(exp, name) for name in STATEMENT_TYPES if hasattr(exp, name))
+    known = {name.lower(): {column.lower() for column in columns} for name, columns in tables.items()}
+    created = set()
+    for statement in statements:
+        if statement is None:
+            continue
+        if not isinstance(statement, statement_types):
+            return "Not a SQL statement; return only SQL, without markdown or prose"
+        
+        # Tables created by the script itself cannot be checked against the schema
+        if isinstance(statement, exp.Create):
+            table = statement.find(exp.Table)
+            if table is not None:
+                created.add(table.name.lower())
+            continue
+        
+        # Other DDL and utility statements are only syntax checked
+        if not isinstance(statement, (exp.Query, exp.Insert, exp.Update, exp.Delete)):
+            continue
+        
+        ctes = {cte.alias_or_name.lower() for cte in statement.find_all(exp.CTE)}
+        sources = {}
+        functions = False
+        for table in statement.find_all(exp.Table):
+            # Table-valued functions, e.g. json_each(...), have no schema to check
+            if not isinstance(table.this, exp.Identifier) or not table.name:
+                functions = True
+                continue
+            name = table.name.lower()
+            if name in ctes or name in created or name.startswith('sqlite_'):
+                continue
+            if name not in known:
+                return f"Table {table.name} does not exist"
+            sources[table.alias_or_name.lower()] = name
+        
+        opaque = bool(ctes) or functions or statement.find(exp.Subquery) is not None
+        aliases = {alias.alias.lower() for alias in statement.find_all(exp.Alias)}
+        for column in statement.find_all(exp.Column):
+            name = column.name.lower()
+            if not name or name == '*' or name in IMPLICIT_COLUMNS:
+                continue
+            qualifier = column.table.lower()
+            # SQLite reads a double-quoted name that matches no column as a string
+            if not qualifier and dialect == 'sqlite' and column.this.args.get('quoted'):
+                continue
+            if qualifier:
+                if qualifier in sources and name not in known[sources[qualifier]]:
+                    return f"Column {column.name} does not exist in table {sources[qualifier]}"
+            elif (sources and not opaque and name not in aliases
+                    and not any(name in known[table] for table in sources.values())):
+                return (
+                    f"Column {column.name} does not exist in table(s) "
+                    f"{', '.join(sorted(set(sources.values())))}"
+                )
+    return None
+
+def validation_node(state: SQLState) -> dict:
+    """Reject SQL that cannot run before spending a database or LLM call on it."""
+    problem = validate_sql(state['sql'], get_table_columns(), get_sqlglot_dialect())
+    if problem is None:
+        return {'validation_error': ''}
+    discard_cached_query(state)
+    return {'validation_error': problem, 'retry_count': state.get('retry_count', 0) + 1}
+
+def route_validation(state: SQLState) -> str:
+    """Run valid SQL, otherwise regenerate it until the retry budget runs out."""
+    if not state.get('validation_error'):
+        return "run_query"
+    if state.get('retry_count', 0) >= MAX_QUERY_RETRIES:
+        return "final_error"
+    return "generate_sql"
+
+def error_handling_node(state: SQLState) -> dict:
     """Handle query errors by generating a corrected query."""
-    schema = state.get('schema', get_schema())
+    from langchain_core.messages import HumanMessage
+    
     messages = [
-        SystemMessage(content=ERROR_HANDLING_PROMPT.format(
+        get_system_message(state['query']),
+        HumanMessage(content=ERROR_HANDLING_PROMPT.format(
             error=state['error'],
-            schema=schema,
             query=state['query'],
             sql=state['sql']
         ))
     ]
-    response = llm.invoke(messages)
+    # Corrections depend on the database's current error, so they are never replayed from disk
+    response = invoke_llm(get_llm().with_structured_output(SQLWithExplanation), messages)
+    
+    retry_count = state.get('retry_count', 0) + 1
     
     # Ensure we have a valid SQL query
-    sql = response.content.strip()
+    sql = response.sql.strip()
     if not sql:
-        return {'error': 'Failed to generate corrected query'}
+        return {'error': 'Failed to generate corrected query', 'retry_count': retry_count}
     
-    return {'sql': sql}
+    # Keep the explanation in sync with the corrected query
+    return {
+        'sql': sql,
+        'explanation': response.explanation.strip(),
+        'error': '',
+        'retry_count': retry_count
+    }
+
+def route_query_result(state: SQLState) -> str:
+    """Finish on success, otherwise correct the query until the retry budget runs out."""
+    if not state.get('error'):
+        return "end"
+    if state.get('retry_count', 0) >= MAX_QUERY_RETRIES:
+        return "final_error"
+    return "handle_error"
 
-def create_sql_agent() -> StateGraph:
-    """Create the SQL agent graph."""
+def create_sql_agent(generate_sql: Callable = query_node) -> StateGraph:
+    """Create the SQL agent graph.
+
+    generate_sql replaces query_node as the SQL generation step, e.g. with
+    the batched node used by the HTTP server.
+    """
+    from langgraph.graph import StateGraph, END
+    
     builder = StateGraph(SQLState)
     
     # Add nodes
-    builder.add_node("generate_sql", query_node)
+    builder.add_node("generate_sql", generate_sql)
+    builder.add_node("validate_sql", validation_node)
     builder.add_node("run_query", execute_node)
-    builder.add_node("explain_query", explain_node)
     builder.add_node("handle_error", error_handling_node)
-    builder.add_node("final_error", lambda state: {'error': 'Final error: ' + state.get('error', 'Unknown error')})
+    builder.add_node("final_error", lambda state: {
+        'error': 'Final error: ' + (state.get('error') or state.get('validation_error') or 'Unknown error')
+    })
     
     # Set entry point
     builder.set_entry_point("generate_sql")
     
     # Add edges
-    builder.add_edge("generate_sql", "run_query")
+    builder.add_edge("generate_sql", "validate_sql")
+    builder.add_conditional_edges("validate_sql",
+        route_validation,
+        {"run_query": "run_query", "generate_sql": "generate_sql", "final_error": "final_error"}
+    )
     builder.add_conditional_edges("run_query", 
-        lambda state: 'error' in state,
-        {True: "handle_error", False: "explain_query"}
+        route_query_result,
+        {"handle_error": "handle_error", "final_error": "final_error", "end": END}
     )
     
     # Add error handling flow
     builder.add_conditional_edges("handle_error", 
-        lambda state: 'error' in state,
-        {True: "final_error", False: "run_query"}
+        lambda state: bool(state.get('error')),
+        {True: "final_error", False: "validate_sql"}
     )
     
     # Add terminal edges
-    builder.add_edge("explain_query", END)
     builder.add_edge("final_error", END)
     
     # Compile the graph
     return builder.compile()
 
+def message_text(message) -> str:
+    """Get the text of a streamed message chunk, including tool call arguments."""
+    text = message.content if isinstance(message.content, str) else ''
+    return text + ''.join(chunk.get('args') or '' for chunk in getattr(message, 'tool_call_chunks', []))
+
+def run_agent(agent, state: SQLState) -> dict:
+    """Run the agent, printing each generated query and streaming its explanation as it arrives.
+
+    The explanation is generated after the SQL in the same structured
+    response, so both are read from the partial JSON as tokens come in.
+    Answers that never reach the model, e.g. cache hits, are printed
+    once the agent finishes.
+    """
+    from langchain_core.utils.json import parse_partial_json
+    
+    result = state
+    drafts: dict[str, str] = {}
+    shown: dict[str, int] = {}
+    streamed_sql = None
+    for mode, chunk in agent.stream(state, stream_mode=["values", "messages"]):
+        if mode == "values":
+            result = chunk
+            continue
+        
+        message, metadata = chunk
+        if metadata.get('langgraph_node') not in ("generate_sql", "handle_error"):
+            continue
+        drafts[message.id] = drafts.get(message.id, '') + message_text(message)
+        try:
+            partial = parse_partial_json(drafts[message.id])
+        except ValueError:
+            continue
+        if not isinstance(partial, dict) or not isinstance(partial.get('explanation'), str):
+            continue
+        
+        # The SQL is complete once the explanation has started
+        if message.id not in shown:
+            if shown:
+                print()
+            streamed_sql = str(partial.get('sql', '')).strip()
+            print("\nGenerated SQL:", streamed_sql)
+            print("\nExplanation: ", end='')
+            shown[message.id] = 0
+        explanation = partial['explanation'].lstrip()
+        print(explanation[shown[message.id]:], end='', flush=True)
+        shown[message.id] = max(shown[message.id], len(explanation))
+    
+    if shown:
+        print()
+    if result.get('sql') and result['sql'] != streamed_sql:
+        print("\nGenerated SQL:", result['sql'])
+        if result.get('explanation'):
+            print("\nExplanation:", result['explanation'])
+    return result
+
 def main():
     """Run the SQL agent."""
-    agent = create_sql_agent()
+    agent = None
     
     print("Welcome to the Text-to-SQL Agent!")
     print("Type 'exit' to quit.")
@@ -165,6 +751,10 @@ def main():
             break
             
         try:
+            # Build the agent on the first question
+            if agent is None:
+                agent = create_sql_agent()
+            
             # Initialize state
             state = SQLState(
                 query=query,
@@ -172,19 +762,15 @@ def main():
                 result='',
                 explanation='',
                 schema=get_schema(),
-                error=''
+                error='',
+                retry_count=0,
+                validation_error=''
             )
             
-            # Run the agent
-            result = agent.invoke(state)
+            # Run the agent, streaming the SQL and its explanation
+            result = run_agent(agent, state)
             
             # Display results
-            if result.get('sql'):
-                print("\nGenerated SQL:", result['sql'])
-            
-            if result.get('explanation'):
-                print("\nExplanation:", result['explanation'])
-            
             if result.get('result'):
                 print("\nResult:", result['result'])
             
@@ -0,0 +1,107 @@
+import unittest
+
+from sql_agent import changes_schema, first_keyword, split_sqlite_statements, validate_sql
+
+TABLES = {
+    'customers': {'id', 'name', 'email'},
+    'orders': {'id', 'customer_id', 'total_amount'},
+}
+
+class SplitSQLiteStatementsTest(unittest.TestCase):
+    def test_single_statement_without_semicolon(self):
+        self.assertEqual(split_sqlite_statements("SELECT 1"), ["SELECT 1"])
+
+    def test_multiple_statements(self):
+        self.assertEqual(
+            split_sqlite_statements("SELECT 1; SELECT 2;"),
+            ["SELECT 1;", "SELECT 2;"]
+        )
+
+    def test_semicolons_in_strings_and_comments(self):
+        self.assertEqual(
+            split_sqlite_statements("SELECT ';' ; /* ; */ SELECT 2 -- ;\n"),
+            ["SELECT ';' ;", "/* ; */ SELECT 2 -- ;"]
+        )
+
+    def test_trigger_body_stays_in_one_statement(self):
+        sql = "CREATE TRIGGER t AFTER INSERT ON orders BEGIN UPDATE customers SET name = 'x'; END; SELECT 1"
+        self.assertEqual(
+            split_sqlite_statements(sql),
+            ["CREATE TRIGGER t AFTER INSERT ON orders BEGIN UPDATE customers SET name = 'x'; END;", "SELECT 1"]
+        )
+
+    def test_empty_script(self):
+        self.assertEqual(split_sqlite_statements(""), [])
+        self.assertEqual(split_sqlite_statements("  \n "), [])
+
+class FirstKeywordTest(unittest.TestCase):
+    def test_skips_leading_comments(self):
+        self.assertEqual(first_keyword("-- note\n/* more */ begin transaction;"), "BEGIN")
+
+    def test_comment_only(self):
+        self.assertEqual(first_keyword("-- nothing here"), "")
+
+class ValidateSQLTest(unittest.TestCase):
+    def assertValid(self, sql):
+        self.assertIsNone(validate_sql(sql, TABLES))
+
+    def assertInvalid(self, sql, message):
+        problem = validate_sql(sql, TABLES)
+        self.assertIsNotNone(problem)
+        self.assertIn(message, problem)
+
+    def test_valid_query(self):
+        self.assertValid("SELECT c.name, o.total_amount FROM customers c JOIN orders o ON o.customer_id = c.id")
+
+    def test_unknown_table(self):
+        self.assertInvalid("SELECT id FROM suppliers", "Table suppliers does not exist")
+
+    def test_unknown_column(self):
+        self.assertInvalid("SELECT nope FROM customers", "Column nope does not exist")
+        self.assertInvalid("SELECT c.nope FROM customers c", "Column nope does not exist in table customers")
+
+    def test_syntax_error(self):
+        self.assertInvalid("SELECT FROM WHERE", "Syntax error")
+
+    def test_bare_expressions_are_rejected(self):
+        for sql in ["SELEC name", "1 + 2", "SELECT 1; SELEC x"]:
+            with self.subTest(sql=sql):
+                self.assertInvalid(sql, "Not a SQL statement")
+
+    def test_markdown_fence_is_rejected(self):
+        self.assertIsNotNone(validate_sql("```sql\nSELECT 1\n```", TABLES))
+
+    def test_values_statement(self):
+        self.assertValid("VALUES (1), (2)")
+
+    def test_double_quoted_string_on_sqlite(self):
+        self.assertValid('SELECT * FROM customers WHERE name = "John Doe"')
+
+    def test_table_valued_functions(self):
+        self.assertValid("SELECT value FROM json_each('[1,2]')")
+        self.assertValid("SELECT name FROM pragma_table_info('customers')")
+        self.assertValid("SELECT c.name, j.value FROM customers c, json_each('[1]') j")
+
+    def test_implicit_rowid_columns(self):
+        self.assertValid("SELECT rowid, oid, _rowid_ FROM customers")
+
+    def test_tables_created_by_the_script(self):
+        self.assertValid("CREATE TABLE suppliers (id INTEGER, name TEXT); INSERT INTO suppliers (name) VALUES ('a')")
+
+    def test_ctes_and_transactions(self):
+        self.assertValid("WITH big AS (SELECT customer_id FROM orders) SELECT customer_id FROM big")
+        self.assertValid("BEGIN; UPDATE customers SET name = 'a' WHERE id = 1; COMMIT;")
+
+class ChangesSchemaTest(unittest.TestCase):
+    def test_ddl(self):
+        for sql in ["CREATE TABLE t (a INTEGER)", "DROP TABLE orders", "ALTER TABLE orders ADD COLUMN note TEXT"]:
+            with self.subTest(sql=sql):
+                self.assertTrue(changes_schema(sql))
+
+    def test_dml_and_reads(self):
+        for sql in ["INSERT INTO orders (id) VALUES (1)", "DELETE FROM orders", "SELECT 1", "PRAGMA table_info(orders)"]:
+            with self.subTest(sql=sql):
+                self.assertFalse(changes_schema(sql))
+
+if __name__ == '__main__':
+    unittest.main()